@@ -3,11 +3,80 @@ Enhanced Excel Extractor - Preserves merged cells structure
 Outputs plain text format instead of markdown tables
 """
 
+import datetime
+import io
 import os
-from typing import Dict, Any, List, Tuple
-from openpyxl import load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.cell.cell import MergedCell
+import re
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Iterable, List, Optional, TextIO, Tuple
+
+# openpyxl is imported where it is used, so importing this module (e.g. from
+# main.py for a PDF run) does not pay for loading it
+
+# SpreadsheetML main namespace (openpyxl.xml.constants.SHEET_MAIN_NS)
+_SHEET_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+# SpreadsheetML tags read by the direct worksheet parser
+_ROW_TAG = f'{{{_SHEET_MAIN_NS}}}row'
+_CELL_TAG = f'{{{_SHEET_MAIN_NS}}}c'
+_VALUE_TAG = f'{{{_SHEET_MAIN_NS}}}v'
+_INLINE_STRING_TAG = f'{{{_SHEET_MAIN_NS}}}is'
+_TEXT_TAG = f'{{{_SHEET_MAIN_NS}}}t'
+_RICH_TEXT_RUN_TAG = f'{{{_SHEET_MAIN_NS}}}r'
+_STRING_ITEM_TAG = f'{{{_SHEET_MAIN_NS}}}si'
+_MERGE_CELL_TAG = f'{{{_SHEET_MAIN_NS}}}mergeCell'
+
+# Patterns for the fast worksheet scanner. _CELL_RE matches one <c> element as
+# Excel, LibreOffice and openpyxl write it: (column letters, row number, style,
+# type, style, <v> text, <is> content). Cells in any other shape make the match
+# count differ from the <c> tag count and the sheet goes to iterparse instead
+_CELL_RE = re.compile(
+    r'<c r="([A-Z]{1,3})(\d+)"(?: s="(\d+)")?(?: t="(\w+)")?(?: s="(\d+)")?(?: (?:cm|vm|ph)="[^"]*")*'
+    r'(?:\s*/>|>(?:<f\b[^>]*?(?:/>|>[^<]*</f>))?(?:<v>([^<]*)</v>|<v\s*/>|<is>(.*?)</is>)?</c>)', re.S)
+_CELL_START_RE = re.compile(r'<c[\s/>]')
+_MERGE_CELL_RE = re.compile(r'<mergeCell ref="([A-Z]+\d+(?::[A-Z]+\d+)?)"\s*/>')
+_MERGE_CELL_START_RE = re.compile(r'<(?:[\w.-]+:)?mergeCell[\s/>]')
+_TEXT_RE = re.compile(r'<t\b[^>]*?(?:/>|>([^<]*)</t>)')
+_PHONETIC_RUN_RE = re.compile(r'<rPh\b.*?</rPh>', re.S)
+_PREFIXED_TAG_RE = re.compile(r'</?[\w.-]+:')
+_XML_ENCODING_RE = re.compile(rb'<\?xml[^>]*?encoding=["\']([\w.-]+)["\']')
+_XML_ENTITY_RE = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|lt|gt|amp|quot|apos);')
+_XML_ENTITIES = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': "'"}
+
+# Keyword scans for business rules (run on the uppercased cell) and scope notes
+# (run on the lowercased cell)
+_RULE_KEYWORDS_RE = re.compile(r'IF |THEN|ELSE|UNION')
+_SCOPE_KEYWORDS_RE = re.compile(r'phạm vi|bản ghi|key:')
+
+class _LineWriter:
+    """
+    Write lines to a text stream the way "\\n".join(lines) would build them.
+    With strip=True leading and trailing blank lines are dropped, matching
+    "\\n".join(lines).strip() for lines without surrounding whitespace.
+    """
+    
+    def __init__(self, out: TextIO, strip: bool = False):
+        self.out = out
+        self.strip = strip
+        self._started = False
+        self._pending_blank = 0
+    
+    def write(self, line: str):
+        if self.strip and not line:
+            # Hold blank lines back until more content follows
+            if self._started:
+                self._pending_blank += 1
+            return
+        if self._started:
+            self.out.write("\n" * (self._pending_blank + 1))
+        self.out.write(line)
+        self._started = True
+        self._pending_blank = 0
+    
+    def writelines(self, lines: Iterable[str]):
+        for line in lines:
+            self.write(line)
 
 class EnhancedExcelExtractor:
     """
@@ -15,19 +84,74 @@ class EnhancedExcelExtractor:
     and outputs in plain text format
     """
     
-    def __init__(self):
-        self.supported_extensions = ['.xlsx', '.xls']
+    # Write buffer for saving formatted output; well above the io default
+    # (st_blksize, often 4-8 KiB) so large outputs need few write syscalls
+    OUTPUT_BUFFER_SIZE = 256 * 1024
+    
+    # Document metadata found in large merged cells, checked in order:
+    # (keywords that must all appear in the lowercased value, metadata key,
+    #  label to remove from the value or None to keep it whole)
+    METADATA_RULES = (
+        (('ngân hàng',), 'Bank', None),
+        (('chi nhánh',), 'Branch', 'Chi nhánh:'),
+        (('phòng',), 'Department', 'Phòng:'),
+        (('ngày', 'giờ'), 'Print Date', 'Ngày giờ in:'),
+        (('bảng kê',), 'Report Title', None),
+        (('báo cáo',), 'Report Title', None),
+    )
     
-    def extract(self, file_path: str) -> Dict[str, Any]:
+    # Leading bytes of the two workbook containers
+    _ZIP_MAGIC = b'PK\x03\x04'          # .xlsx/.xlsb (zip package)
+    _OLE2_MAGIC = b'\xd0\xcf\x11\xe0'  # legacy .xls
+    
+    # Formats without worksheet XML, read through the optional python-calamine
+    CALAMINE_EXTENSIONS = ('.xls', '.xlsb')
+    
+    # Worksheet parts up to this uncompressed size are read whole and scanned
+    # with _fast_scan_sheet; larger ones are streamed through iterparse so
+    # memory stays flat
+    FAST_SCAN_MAX_BYTES = 32 * 1024 * 1024
+    
+    # Sheets only go to worker processes when there is at least this much
+    # worksheet data (uncompressed XML, or the file size for .xls/.xlsb);
+    # below it process startup and pickling the results cost more than the
+    # parallel parse saves
+    PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+    
+    # Maximum number of sheet analyses kept for reuse across formatter calls
+    ANALYSIS_CACHE_SIZE = 64
+    
+    def __init__(self, collapse_repeated_rows: bool = False):
+        """
+        collapse_repeated_rows: in the LLM-optimized output, drop table rows that
+        repeat the header and write runs of identical rows once, with the run
+        length in a trailing × column, and skip text rows already written in the
+        same section
         """
-        Extract content from Excel file preserving merged cells structure
+        self.supported_extensions = ['.xlsx', '.xls', '.xlsb']
+        self.collapse_repeated_rows = collapse_repeated_rows
+        
+        # Sheet analyses keyed by id() of the grid; each entry keeps the grid
+        # and copies of its rows and merged cells, so an edited sheet misses
+        self._analysis_cache: OrderedDict = OrderedDict()
+    
+    def extract(self, file_path: str, max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Extract content from Excel file preserving merged cells structure.
+        With max_workers > 1 the sheets of a multi-sheet workbook holding at
+        least PARALLEL_MIN_BYTES of sheet data are parsed in a pool of worker
+        processes, each opening the workbook on its own
         """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
         
-        if not self.is_supported_file(file_path):
+        # The extension picks both the expected container and the reader
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext not in self.supported_extensions:
             raise ValueError(f"Unsupported file format. Supported: {', '.join(self.supported_extensions)}")
         
+        self._validate_excel_file(file_path, ext)
+        
         result = {
             'filename': os.path.basename(file_path),
             'file_type': 'Excel',
@@ -37,27 +161,41 @@ class EnhancedExcelExtractor:
         }
         
         try:
-            # Load workbook
+            # Load the workbook-level parts only; worksheets are parsed directly
+            # from their XML instead of through openpyxl cell objects
             print(f"Loading Excel workbook...")
-            workbook = load_workbook(file_path, data_only=True)
+            workbook = self._open_workbook(file_path, ext)
+            sheet_names = list(workbook['sheets'])
             
-            # Process each worksheet
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                print(f"Processing sheet: {sheet_name}")
+            if (max_workers and max_workers > 1 and len(sheet_names) > 1
+                    and self._sheet_data_size(workbook, file_path) >= self.PARALLEL_MIN_BYTES):
+                # Parsing is CPU-bound Python, so sheets go to processes rather
+                # than threads; each worker opens the archive on its own
+                from concurrent.futures import ProcessPoolExecutor
                 
-                sheet_content = self._extract_sheet_content(sheet)
-                result['sheets'][sheet_name] = sheet_content
+                workbook['archive'].close()
+                with ProcessPoolExecutor(max_workers=min(max_workers, len(sheet_names))) as executor:
+                    sheets = executor.map(_extract_sheet_worker,
+                                          [(file_path, sheet_name) for sheet_name in sheet_names])
+                    result['sheets'] = dict(zip(sheet_names, sheets))
+            else:
+                try:
+                    # Process each worksheet
+                    for sheet_name in sheet_names:
+                        result['sheets'][sheet_name] = self._extract_sheet_by_name(workbook, sheet_name)
+                finally:
+                    workbook['archive'].close()
             
             # Combine all sheets content
             result['content'] = self._combine_sheets_content(result['sheets'])
             
             # Extract metadata
             result['metadata'] = {
-                'sheets_count': len(workbook.sheetnames),
-                'sheet_names': workbook.sheetnames,
+                'sheets_count': len(sheet_names),
+                'sheet_names': sheet_names,
                 'extraction_method': 'Enhanced Excel Extractor',
-                'preserves_merged_cells': True
+                'preserves_merged_cells': True,
+                'total_merged_cells': sum(len(sheet['merged_cells']) for sheet in result['sheets'].values())
             }
             
             print(f"Excel processed successfully - {result['metadata']['sheets_count']} sheets")
@@ -67,42 +205,446 @@ class EnhancedExcelExtractor:
         
         return result
     
-    def _extract_sheet_content(self, sheet: Worksheet) -> Dict[str, Any]:
+    def _sheet_data_size(self, workbook: Dict[str, Any], file_path: str) -> int:
+        """Amount of worksheet data in an opened workbook, used to decide on parallel parsing"""
+        if workbook.get('engine') == 'calamine':
+            return os.path.getsize(file_path)
+        archive = workbook['archive']
+        return sum(archive.getinfo(part_name).file_size for part_name in workbook['sheets'].values())
+    
+    def _validate_excel_file(self, file_path: str, ext: str):
         """
-        Extract content from a single worksheet preserving structure
+        Check the container from the file's leading bytes, so a mislabelled
+        file fails fast with a clear message instead of deep in the zip reader
+        """
+        with open(file_path, 'rb') as f:
+            magic = f.read(4)
+        
+        if magic == (self._OLE2_MAGIC if ext == '.xls' else self._ZIP_MAGIC):
+            return
+        
+        filename = os.path.basename(file_path)
+        if magic == self._OLE2_MAGIC:
+            raise ValueError(f"{filename} is a legacy .xls or password-protected workbook, not {ext}")
+        if magic == self._ZIP_MAGIC:
+            raise ValueError(f"{filename} is an Office Open XML workbook - rename it to .xlsx")
+        raise ValueError(f"Not an Excel workbook: {filename}")
+    
+    def _open_workbook(self, file_path: str, ext: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Read the workbook-level parts (sheet list, shared strings, date styles)
+        without loading any worksheet. The caller closes the returned archive
+        """
+        if ext is None:
+            ext = os.path.splitext(file_path)[1].lower()
+        if ext in self.CALAMINE_EXTENSIONS:
+            return self._open_calamine_workbook(file_path)
+        
+        from openpyxl.reader.excel import ExcelReader
+        from openpyxl.styles.stylesheet import apply_stylesheet
+        from openpyxl.xml.constants import SHARED_STRINGS
+        
+        reader = ExcelReader(file_path, read_only=True, data_only=True)
+        try:
+            reader.read_manifest()
+            reader.read_workbook()
+            apply_stylesheet(reader.archive, reader.wb)
+            
+            # Worksheet parts by sheet name, in workbook order (chartsheets have no cells)
+            sheets = {}
+            for sheet, rel in reader.parser.find_sheets():
+                if rel.target in reader.valid_files and 'chartsheet' not in rel.Type:
+                    sheets[sheet.name] = rel.target
+            
+            shared_strings = []
+            strings_part = reader.package.find(SHARED_STRINGS)
+            if strings_part is not None:
+                with reader.archive.open(strings_part.PartName[1:]) as source:
+                    shared_strings = self._read_shared_strings(source)
+        except Exception:
+            reader.archive.close()
+            raise
+        
+        return {
+            'archive': reader.archive,
+            'sheets': sheets,
+            # Stripped once here; cells then reference these very objects, so
+            # repeated strings share one str across the whole grid
+            'shared_strings': [text.strip() for text in shared_strings],
+            # Inline strings, numbers and other non-shared values seen so far,
+            # so repeats of one value share a single str as well
+            'values': {},
+            'epoch': reader.wb.epoch,
+            'date_formats': reader.wb._date_formats,
+            'timedelta_formats': reader.wb._timedelta_formats
+        }
+    
+    def _open_calamine_workbook(self, file_path: str) -> Dict[str, Any]:
+        """
+        Open a .xls/.xlsb workbook with python-calamine. The returned dict has
+        the same 'archive' (closed by the caller) and 'sheets' keys
+        """
+        try:
+            from python_calamine import CalamineWorkbook, SheetTypeEnum
+        except ImportError:
+            raise ImportError("Reading .xls/.xlsb files requires python-calamine: pip install python-calamine")
+        
+        workbook = CalamineWorkbook.from_path(file_path)
+        return {
+            'archive': workbook,
+            'engine': 'calamine',
+            # Sheet names in workbook order (chartsheets have no cells)
+            'sheets': {meta.name: meta.name for meta in workbook.sheets_metadata
+                       if meta.typ != SheetTypeEnum.ChartSheet}
+        }
+    
+    def _read_shared_strings(self, source) -> List[str]:
+        """Read the shared string table as plain text, like openpyxl does"""
+        strings = []
+        for _, elem in ET.iterparse(source):
+            if elem.tag == _STRING_ITEM_TAG:
+                strings.append(self._text_content(elem).replace('x005F_', ''))
+                elem.clear()
+        return strings
+    
+    def _text_content(self, elem) -> str:
+        """Plain text of a string item: its <t> plus all rich text runs, without phonetics"""
+        parts = []
+        for child in elem:
+            if child.tag == _TEXT_TAG:
+                parts.append(child.text or '')
+            elif child.tag == _RICH_TEXT_RUN_TAG:
+                parts.append(child.findtext(_TEXT_TAG) or '')
+        return ''.join(parts)
+    
+    def _extract_sheet_by_name(self, workbook: Dict[str, Any], sheet_name: str) -> Dict[str, Any]:
         """
-        # Get the used range
-        min_row, max_row = 1, sheet.max_row
-        min_col, max_col = 1, sheet.max_column
+        Extract one worksheet of an opened workbook
+        """
+        print(f"Processing sheet: {sheet_name}")
+        if workbook.get('engine') == 'calamine':
+            sheet = workbook['archive'].get_sheet_by_name(sheet_name)
+            return self._extract_sheet_content(self._parse_calamine_sheet(sheet))
+        
+        archive = workbook['archive']
+        part_name = workbook['sheets'][sheet_name]
+        if archive.getinfo(part_name).file_size <= self.FAST_SCAN_MAX_BYTES:
+            data = archive.read(part_name)
+            sheet_xml = self._fast_scan_sheet(data, workbook)
+            if sheet_xml is None:
+                sheet_xml = self._parse_sheet_xml(io.BytesIO(data), workbook)
+            return self._extract_sheet_content(sheet_xml)
+        with archive.open(part_name) as source:
+            return self._extract_sheet_content(self._parse_sheet_xml(source, workbook))
+    
+    def _fast_scan_sheet(self, data: bytes, workbook: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Scan a worksheet part with regular expressions instead of an XML parser,
+        producing the same result as _parse_sheet_xml. Returns None for anything
+        outside the plain layout spreadsheet writers produce (other encodings or
+        namespaces, comments, CDATA, unusual cell markup), which then needs iterparse
+        """
+        from openpyxl.utils.datetime import from_ISO8601
+        from openpyxl.worksheet.cell_range import MultiCellRange
+        
+        declaration = _XML_ENCODING_RE.match(data, 0, 200)
+        if declaration and declaration.group(1).lower() not in (b'utf-8', b'utf8'):
+            return None
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return None
+        if '<!' in text:
+            # DOCTYPE (entity definitions), comments or CDATA
+            return None
+        
+        root_start = text.find('<worksheet')
+        if root_start == -1 or f'xmlns="{_SHEET_MAIN_NS}"' not in text[root_start:text.find('>', root_start)]:
+            return None
+        
+        data_start = text.find('<sheetData')
+        if data_start == -1:
+            cells_xml, tail = '', text
+        elif text.startswith('/>', text.find('>', data_start) - 1):
+            cells_xml, tail = '', text[data_start:]
+        else:
+            data_end = text.find('</sheetData>', data_start)
+            if data_end == -1:
+                return None
+            cells_xml, tail = text[data_start:data_end], text[data_end:]
+        if _PREFIXED_TAG_RE.search(cells_xml):
+            return None
+        if '\r' in cells_xml:
+            # XML parsers hand text over with normalised line ends
+            cells_xml = cells_xml.replace('\r\n', '\n').replace('\r', '\n')
+        
+        cells_found = _CELL_RE.findall(cells_xml)
+        if len(cells_found) != len(_CELL_START_RE.findall(cells_xml)):
+            return None
+        merge_refs = _MERGE_CELL_RE.findall(tail)
+        if len(merge_refs) != len(_MERGE_CELL_START_RE.findall(tail)):
+            return None
+        
+        shared_strings = workbook['shared_strings']
+        values = workbook['values']
+        rows = []
+        max_row = max_col = 0
+        columns = {}
+        current_ref = None
+        cells = []
+        last_col = 0
+        
+        for letters, row_ref, style_id, data_type, style_after, value, inline in cells_found:
+            col_idx = columns.get(letters)
+            if col_idx is None:
+                col_idx = 0
+                for ch in letters:
+                    col_idx = col_idx * 26 + (ord(ch) & 31)
+                columns[letters] = col_idx
+            if row_ref != current_ref:
+                # Cells of a row are contiguous, so a new row number starts a new row;
+                # like iterparse, the used range counts each row's last cell
+                current_ref = row_ref
+                row_idx = int(row_ref)
+                cells = []
+                rows.append((row_idx - 1, cells))
+                max_row = max(max_row, row_idx)
+                max_col = max(max_col, last_col)
+            last_col = col_idx
+            
+            if data_type == 's':
+                if value:
+                    value = shared_strings[int(value)]
+                    if value:
+                        cells.append((col_idx - 1, value))
+                continue
+            
+            if data_type == 'inlineStr':
+                if '<rPh' in inline:
+                    inline = _PHONETIC_RUN_RE.sub('', inline)
+                value = ''.join(_TEXT_RE.findall(inline))
+            elif not value:
+                continue
+            elif data_type == 'n' or not data_type:
+                value = self._format_number(value, style_id or style_after, workbook)
+            elif data_type == 'b':
+                value = str(bool(int(value)))
+            elif data_type == 'd':
+                value = str(from_ISO8601(value))
+            
+            if '&' in value:
+                value = self._unescape_xml(value)
+            value = value.strip()
+            if value:
+                cells.append((col_idx - 1, values.setdefault(value, value)))
         
-        # Create a grid to represent the sheet structure
-        grid = []
-        merged_ranges = list(sheet.merged_cells.ranges)
+        max_col = max(max_col, last_col)
         
-        # Initialize grid with empty values
-        for row in range(max_row):
-            grid.append([''] * max_col)
+        merged_ranges = MultiCellRange()
+        for ref in merge_refs:
+            merged_ranges.add(ref)
         
-        # Fill grid with cell values
-        for row in range(min_row, max_row + 1):
-            for col in range(min_col, max_col + 1):
-                cell = sheet.cell(row=row, column=col)
+        return {
+            'rows': [row for row in rows if row[1]],
+            'max_row': max_row,
+            'max_col': max_col,
+            'merged_ranges': list(merged_ranges.ranges)
+        }
+    
+    def _unescape_xml(self, text: str) -> str:
+        """Resolve the predefined XML entities and character references"""
+        def replace(match):
+            name = match.group(1)
+            if name[0] != '#':
+                return _XML_ENTITIES[name]
+            return chr(int(name[2:], 16) if name[1] == 'x' else int(name[1:]))
+        return _XML_ENTITY_RE.sub(replace, text)
+    
+    def _parse_sheet_xml(self, source, workbook: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Stream a worksheet part in one pass, collecting the non-blank cell values
+        (as stripped strings, the way openpyxl would convert them with data_only=True),
+        the used range and the merged ranges
+        """
+        from openpyxl.utils.datetime import from_ISO8601
+        from openpyxl.worksheet.cell_range import MultiCellRange
+        
+        shared_strings = workbook['shared_strings']
+        values = workbook['values']
+        rows = []
+        max_row = max_col = 0
+        row_idx = 0
+        # Collected the same way openpyxl fills sheet.merged_cells
+        merged_ranges = MultiCellRange()
+        
+        for _, elem in ET.iterparse(source):
+            tag = elem.tag
+            if tag == _ROW_TAG:
+                row_ref = elem.get('r')
+                row_idx = int(float(row_ref)) if row_ref else row_idx + 1
+                col_idx = 0
+                cells = []
+                for cell in elem:
+                    if cell.tag != _CELL_TAG:
+                        continue
+                    
+                    # Column from the letters of the reference, e.g. "AB12" -> 28
+                    ref = cell.get('r')
+                    if ref:
+                        col_idx = 0
+                        for ch in ref:
+                            if ch < 'A':
+                                break
+                            col_idx = col_idx * 26 + (ord(ch) & 31)
+                    else:
+                        col_idx += 1
+                    
+                    data_type = cell.get('t', 'n')
+                    if data_type == 's':
+                        value = cell.findtext(_VALUE_TAG)
+                        if value:
+                            value = shared_strings[int(value)]
+                            if value:
+                                cells.append((col_idx - 1, value))
+                        continue
+                    
+                    if data_type == 'inlineStr':
+                        inline = cell.find(_INLINE_STRING_TAG)
+                        if inline is None:
+                            continue
+                        value = self._text_content(inline)
+                    else:
+                        value = cell.findtext(_VALUE_TAG)
+                        if not value:
+                            continue
+                        if data_type == 'n':
+                            value = self._format_number(value, cell.get('s'), workbook)
+                        elif data_type == 'b':
+                            value = str(bool(int(value)))
+                        elif data_type == 'd':
+                            value = str(from_ISO8601(value))
+                        # 'str' (formula result) and 'e' (error) keep their text
+                    
+                    value = value.strip()
+                    if value:
+                        cells.append((col_idx - 1, values.setdefault(value, value)))
                 
-                if not isinstance(cell, MergedCell):
-                    value = cell.value
-                    if value is not None:
-                        grid[row-1][col-1] = str(value)
+                # Any <c> counts towards the used range, even without a value
+                if col_idx:
+                    max_row = max(max_row, row_idx)
+                    max_col = max(max_col, col_idx)
+                if cells:
+                    rows.append((row_idx - 1, cells))
+                elem.clear()
+            elif tag == _MERGE_CELL_TAG:
+                merged_ranges.add(elem.get('ref'))
+        
+        return {
+            'rows': rows,
+            'max_row': max_row,
+            'max_col': max_col,
+            'merged_ranges': list(merged_ranges.ranges)
+        }
+    
+    def _parse_calamine_sheet(self, sheet) -> Dict[str, Any]:
+        """
+        Collect a python-calamine worksheet in the same form as _parse_sheet_xml
+        """
+        from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+        
+        rows = []
+        for row_idx, row in enumerate(sheet.to_python(skip_empty_area=False)):
+            cells = []
+            for col_idx, value in enumerate(row):
+                if value == '':
+                    continue
+                value = self._format_calamine_value(value).strip()
+                if value:
+                    cells.append((col_idx, value))
+            if cells:
+                rows.append((row_idx, cells))
+        
+        # Merged ranges are 0-based ((first row, first col), (last row, last col));
+        # calamine has none for .xlsb
+        merged_ranges = MultiCellRange()
+        for (start_row, start_col), (end_row, end_col) in sheet.merged_cell_ranges or ():
+            merged_ranges.add(CellRange(min_col=start_col + 1, min_row=start_row + 1,
+                                        max_col=end_col + 1, max_row=end_row + 1))
+        
+        end = sheet.end
+        return {
+            'rows': rows,
+            'max_row': end[0] + 1 if end else 0,
+            'max_col': end[1] + 1 if end else 0,
+            'merged_ranges': list(merged_ranges.ranges)
+        }
+    
+    def _format_calamine_value(self, value: Any) -> str:
+        """Render a calamine cell value the way the .xlsx reader renders the same cell"""
+        if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+            # Whole numbers come back as floats; .xlsx stores these as integers
+            value = int(value)
+        elif type(value) is datetime.date:
+            # Date-formatted serials read as datetimes from .xlsx
+            value = datetime.datetime.combine(value, datetime.time())
+        return str(value)
+    
+    def _format_number(self, value: str, style_id: Optional[str], workbook: Dict[str, Any]) -> str:
+        """Render a numeric cell, converting serials in date-formatted cells to dates"""
+        number = float(value) if ('.' in value or 'E' in value or 'e' in value) else int(value)
+        # A cell without an s attribute uses cell style 0, which may be a date format too
+        style_id = int(style_id or 0)
+        if style_id in workbook['date_formats']:
+            from openpyxl.utils.datetime import from_excel
+            try:
+                number = from_excel(number, workbook['epoch'],
+                                    timedelta=style_id in workbook['timedelta_formats'])
+            except (OverflowError, ValueError):
+                # Outside the limits for dates - openpyxl reports these as errors too
+                return '#VALUE!'
+        return str(number)
+    
+    def _extract_sheet_content(self, sheet_xml: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extract content from a single worksheet preserving structure
+        """
+        # Size the grid from the cells actually present rather than the
+        # <dimension> header, which some writers get wrong
+        max_row = max(sheet_xml['max_row'], 1)
+        max_col = max(sheet_xml['max_col'], 1)
+        merged_ranges = sheet_xml['merged_ranges']
+        
+        # Merged areas count towards the used range even where they hold no cells
+        for merged_range in merged_ranges:
+            max_row = max(max_row, merged_range.max_row)
+            max_col = max(max_col, merged_range.max_col)
+        
+        # Create a grid to represent the sheet structure and fill in the values.
+        # Values are stored stripped so the formatters can test cells by truthiness
+        grid = [[''] * max_col for _ in range(max_row)]
+        for row_idx, cells in sheet_xml['rows']:
+            grid_row = grid[row_idx]
+            for col_idx, value in cells:
+                grid_row[col_idx] = value
+        
+        # Cells covered by a merge can still hold values (e.g. hidden contents
+        # kept by LibreOffice); like openpyxl's MergedCell they read as blank
+        for merged_range in merged_ranges:
+            start_col = merged_range.min_col - 1
+            end_col = merged_range.max_col
+            grid[merged_range.min_row - 1][start_col + 1:end_col] = [''] * (end_col - start_col - 1)
+            for row_idx in range(merged_range.min_row, merged_range.max_row):
+                grid[row_idx][start_col:end_col] = [''] * (end_col - start_col)
         
         # Process merged cells
         merged_info = []
         for merged_range in merged_ranges:
             # Get the top-left cell value
-            top_left_cell = sheet.cell(row=merged_range.min_row, column=merged_range.min_col)
-            value = top_left_cell.value
-            if value is not None:
+            value = grid[merged_range.min_row - 1][merged_range.min_col - 1]
+            if value:
                 merged_info.append({
                     'range': str(merged_range),
-                    'value': str(value),
+                    'value': value,
                     'start_row': merged_range.min_row,
                     'end_row': merged_range.max_row,
                     'start_col': merged_range.min_col,
@@ -115,34 +657,86 @@ class EnhancedExcelExtractor:
             'dimensions': {
                 'rows': max_row,
                 'cols': max_col
-            }
+            },
+            'nonempty_counts': self._count_nonempty_cells(grid)
+        }
+    
+    def _index_merged_cells(self, merged_cells: List[Dict], max_col: int) -> Dict[str, Dict]:
+        """
+        Build lookup tables over merged cells (0-based coordinates):
+        anchor -> merge, row -> anchor per column (rows touched by merges only),
+        row -> merges touching it
+        """
+        merged_by_anchor = {}
+        merged_anchor_rows = {}
+        merged_by_row = {}
+        for merged in merged_cells:
+            anchor = (merged['start_row'] - 1, merged['start_col'] - 1)
+            merged_by_anchor[anchor] = merged
+            start_col, end_col = merged['start_col'] - 1, merged['end_col']
+            for row in range(merged['start_row'] - 1, merged['end_row']):
+                merged_by_row.setdefault(row, []).append(merged)
+                anchors = merged_anchor_rows.get(row)
+                if anchors is None:
+                    anchors = merged_anchor_rows[row] = [None] * max_col
+                # One slice assignment covers the whole span of the merge in this row
+                anchors[start_col:end_col] = [anchor] * (end_col - start_col)
+        
+        return {
+            'merged_by_anchor': merged_by_anchor,
+            'merged_anchor_rows': merged_anchor_rows,
+            'merged_by_row': merged_by_row
         }
     
+    def _get_merged_index(self, sheet_data: Dict[str, Any]) -> Tuple[Dict, Dict, Dict]:
+        """Merged cell lookup tables of a sheet, built per formatter call"""
+        index = self._index_merged_cells(sheet_data['merged_cells'], sheet_data['dimensions']['cols'])
+        return index['merged_by_anchor'], index['merged_anchor_rows'], index['merged_by_row']
+    
+    def _count_nonempty_cells(self, grid: List[List[str]]) -> List[int]:
+        """
+        Count non-blank cells per row - shared by all the row scans below
+        """
+        # Cells are stored stripped, so blanks are exactly '' and list.count
+        # does the scan in C
+        return [len(row) - row.count('') for row in grid]
+    
+    def _get_nonempty_counts(self, sheet_data: Dict[str, Any]) -> List[int]:
+        """Per-row non-blank cell counts of a sheet, as extracted or counted now"""
+        counts = sheet_data.get('nonempty_counts')
+        if counts is None:
+            counts = self._count_nonempty_cells(sheet_data['grid'])
+        return counts
+    
     def _combine_sheets_content(self, sheets: Dict[str, Any]) -> str:
         """
         Combine all sheets content into plain text format
         """
-        content_parts = []
+        buf = io.StringIO()
+        self._write_sheets_content(sheets, buf)
+        return buf.getvalue()
+    
+    def _write_sheets_content(self, sheets: Dict[str, Any], out: TextIO):
+        """Write the combined sheets content to a text stream"""
+        lines = _LineWriter(out)
         
         for sheet_name, sheet_data in sheets.items():
-            content_parts.append(f"=== SHEET: {sheet_name} ===\n")
+            lines.write(f"=== SHEET: {sheet_name} ===\n")
             
             # Add merged cells information
             if sheet_data['merged_cells']:
-                content_parts.append("--- MERGED CELLS STRUCTURE ---")
+                lines.write("--- MERGED CELLS STRUCTURE ---")
                 for merged in sheet_data['merged_cells']:
-                    content_parts.append(f"Range {merged['range']}: {merged['value']}")
-                content_parts.append("")
+                    lines.write(f"Range {merged['range']}: {merged['value']}")
+                lines.write("")
             
             # Add grid content in structured format
-            content_parts.append("--- SHEET CONTENT ---")
+            lines.write("--- SHEET CONTENT ---")
             grid = sheet_data['grid']
+            nonempty_counts = self._get_nonempty_counts(sheet_data)
             
             # Find non-empty rows and columns
-            non_empty_rows = []
-            for i, row in enumerate(grid):
-                if any(cell.strip() for cell in row if cell):
-                    non_empty_rows.append(i)
+            non_empty_rows = [i for i, count in enumerate(nonempty_counts) if count]
             
             if non_empty_rows:
                 # Determine column widths for better formatting
@@ -153,88 +747,87 @@ class EnhancedExcelExtractor:
                     row_content = []
                     
                     for col_idx, cell in enumerate(row):
-                        if cell.strip():  # Only show non-empty cells
+                        if cell:  # Only show non-empty cells
                             # Truncate long content
                             display_value = cell[:max_col_width] + "..." if len(cell) > max_col_width else cell
                             row_content.append(f"Col{col_idx+1}: {display_value}")
                     
                     if row_content:
-                        content_parts.append(f"Row {row_idx+1}: {' | '.join(row_content)}")
+                        lines.write(f"Row {row_idx+1}: {' | '.join(row_content)}")
             
-            content_parts.append("\n" + "="*60 + "\n")
-        
-        return "\n".join(content_parts)
+            lines.write("\n" + "="*60 + "\n")
     
     def to_plain_text(self, extracted_data: Dict[str, Any]) -> str:
         """
         Convert extracted data to structured plain text
         """
-        content_parts = []
+        buf = io.StringIO()
+        self._write_plain_text(extracted_data, buf)
+        return buf.getvalue()
+    
+    def _write_plain_text(self, extracted_data: Dict[str, Any], out: TextIO):
+        """Write the structured plain text to a text stream"""
+        lines = _LineWriter(out)
         
         # Add header information
-        content_parts.append("EXCEL DOCUMENT STRUCTURE ANALYSIS")
-        content_parts.append("="*50)
-        content_parts.append(f"File: {extracted_data['filename']}")
-        content_parts.append(f"Sheets: {', '.join(extracted_data['metadata']['sheet_names'])}")
-        content_parts.append("")
+        lines.write("EXCEL DOCUMENT STRUCTURE ANALYSIS")
+        lines.write("="*50)
+        lines.write(f"File: {extracted_data['filename']}")
+        lines.write(f"Sheets: {', '.join(extracted_data['metadata']['sheet_names'])}")
+        lines.write("")
         
         # Add detailed sheet analysis
         for sheet_name, sheet_data in extracted_data['sheets'].items():
-            content_parts.append(f"SHEET: {sheet_name}")
-            content_parts.append("-" * 30)
-            content_parts.append(f"Dimensions: {sheet_data['dimensions']['rows']} rows × {sheet_data['dimensions']['cols']} columns")
-            content_parts.append(f"Merged cells: {len(sheet_data['merged_cells'])}")
-            content_parts.append("")
+            lines.write(f"SHEET: {sheet_name}")
+            lines.write("-" * 30)
+            lines.write(f"Dimensions: {sheet_data['dimensions']['rows']} rows × {sheet_data['dimensions']['cols']} columns")
+            lines.write(f"Merged cells: {len(sheet_data['merged_cells'])}")
+            lines.write("")
             
             # Show merged cells structure first
             if sheet_data['merged_cells']:
-                content_parts.append("MERGED CELLS:")
+                lines.write("MERGED CELLS:")
                 for merged in sheet_data['merged_cells']:
                     rows_span = merged['end_row'] - merged['start_row'] + 1
                     cols_span = merged['end_col'] - merged['start_col'] + 1
-                    content_parts.append(f"  • {merged['range']} ({rows_span}×{cols_span}): {merged['value']}")
-                content_parts.append("")
+                    lines.write(f"  • {merged['range']} ({rows_span}×{cols_span}): {merged['value']}")
+                lines.write("")
             
             # Show content in a more readable format
-            content_parts.append("CONTENT STRUCTURE:")
+            lines.write("CONTENT STRUCTURE:")
             grid = sheet_data['grid']
+            nonempty_counts = self._get_nonempty_counts(sheet_data)
             
             # Group by logical sections based on merged cells and content
             current_section = []
             for row_idx, row in enumerate(grid):
-                if any(cell.strip() for cell in row if cell):
+                if nonempty_counts[row_idx]:
                     row_content = []
                     for col_idx, cell in enumerate(row):
-                        if cell.strip():
+                        if cell:
                             row_content.append(f"[{row_idx+1},{col_idx+1}] {cell}")
                     
                     if row_content:
                         current_section.append("  " + " | ".join(row_content))
                         
                         # Add section break after significant gaps
-                        if len(current_section) > 0 and self._is_section_break(grid, row_idx):
-                            content_parts.extend(current_section)
-                            content_parts.append("")
+                        if len(current_section) > 0 and self._is_section_break(nonempty_counts, row_idx):
+                            lines.writelines(current_section)
+                            lines.write("")
                             current_section = []
             
             # Add remaining content
             if current_section:
-                content_parts.extend(current_section)
+                lines.writelines(current_section)
             
-            content_parts.append("\n" + "="*60 + "\n")
-        
-        return "\n".join(content_parts)
+            lines.write("\n" + "="*60 + "\n")
     
-    def _is_section_break(self, grid: List[List[str]], current_row: int) -> bool:
+    def _is_section_break(self, nonempty_counts: List[int], current_row: int) -> bool:
         """
         Determine if there should be a section break after current row
         """
         # Check if next few rows are empty (indicates section break)
-        for i in range(1, min(3, len(grid) - current_row)):
-            next_row = grid[current_row + i]
-            if any(cell.strip() for cell in next_row if cell):
-                return False
-        return True
+        return not any(nonempty_counts[current_row + 1:current_row + 3])
     
     def is_supported_file(self, file_path: str) -> bool:
         """Check if file format is supported"""
@@ -251,23 +844,30 @@ class EnhancedExcelExtractor:
         - Plain text for merged header cells
         - Markdown tables for data sections
         """
-        content_parts = []
+        buf = io.StringIO()
+        self._write_hybrid_markdown(extracted_data, buf)
+        return buf.getvalue()
+    
+    def _write_hybrid_markdown(self, extracted_data: Dict[str, Any], out: TextIO):
+        """Write the hybrid markdown to a text stream"""
+        lines = _LineWriter(out)
         
         # Add header information
-        content_parts.append(f"# {extracted_data['filename']}")
-        content_parts.append("")
+        lines.write(f"# {extracted_data['filename']}")
+        lines.write("")
         
         # Process each sheet
         for sheet_name, sheet_data in extracted_data['sheets'].items():
             if len(extracted_data['sheets']) > 1:
-                content_parts.append(f"## Sheet: {sheet_name}")
-                content_parts.append("")
+                lines.write(f"## Sheet: {sheet_name}")
+                lines.write("")
             
             grid = sheet_data['grid']
-            merged_cells = sheet_data['merged_cells']
+            merged_by_anchor, merged_anchor_rows, merged_by_row = self._get_merged_index(sheet_data)
             
             # Identify header sections and data table sections
-            header_rows, data_sections = self._identify_sections(grid, merged_cells)
+            analysis = self._get_sheet_analysis(sheet_data)
+            header_rows, data_sections = analysis['header_rows'], analysis['sections']
             
             # Process each section
             current_row = 0
@@ -276,71 +876,105 @@ class EnhancedExcelExtractor:
                 # Add any header rows before this section
                 while current_row < start_row:
                     if current_row in header_rows:
-                        header_content = self._format_header_row(grid[current_row], current_row, merged_cells)
+                        header_content = self._format_header_row(grid[current_row], current_row, merged_by_row)
                         if header_content:
-                            content_parts.append(header_content)
-                            content_parts.append("")
+                            lines.write(header_content)
+                            lines.write("")
                     current_row += 1
                 
                 # Process the section
                 if section_type == 'table':
-                    table_content = self._format_table_section(grid, start_row, end_row, merged_cells)
+                    table_content = analysis['tables'].get((start_row, end_row))
+                    if table_content is None:
+                        table_content = analysis['tables'][(start_row, end_row)] = self._format_table_section(
+                            grid, start_row, end_row, merged_by_anchor, merged_anchor_rows)
                     if table_content:
-                        content_parts.extend(table_content)
-                        content_parts.append("")
+                        lines.writelines(table_content)
+                        lines.write("")
                 elif section_type == 'header':
                     for row_idx in range(start_row, end_row + 1):
-                        header_content = self._format_header_row(grid[row_idx], row_idx, merged_cells)
+                        header_content = self._format_header_row(grid[row_idx], row_idx, merged_by_row)
                         if header_content:
-                            content_parts.append(header_content)
-                    content_parts.append("")
+                            lines.write(header_content)
+                    lines.write("")
                 
                 current_row = end_row + 1
             
             # Process remaining header rows
             while current_row < len(grid):
                 if current_row in header_rows:
-                    header_content = self._format_header_row(grid[current_row], current_row, merged_cells)
+                    header_content = self._format_header_row(grid[current_row], current_row, merged_by_row)
                     if header_content:
-                        content_parts.append(header_content)
-                        content_parts.append("")
+                        lines.write(header_content)
+                        lines.write("")
                 current_row += 1
-        
-        return "\n".join(content_parts)
     
-    def _identify_sections(self, grid: List[List[str]], merged_cells: List[Dict]) -> Tuple[set, List[Tuple[str, int, int]]]:
+    def _get_sheet_analysis(self, sheet_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Section layout and formatted tables of a sheet, computed on first use
+        and reused by later formatter calls on the same sheet
+        """
+        grid, merged_cells = sheet_data['grid'], sheet_data['merged_cells']
+        key = id(grid)
+        
+        # The row copies share their strings with the grid, so comparing them
+        # is a pointer check per cell
+        entry = self._analysis_cache.get(key)
+        if (entry is not None and entry[0] is grid
+                and entry[1] == grid and entry[2] == merged_cells):
+            self._analysis_cache.move_to_end(key)
+            return entry[3]
+        
+        header_rows, sections = self._identify_sections(grid, merged_cells, self._get_nonempty_counts(sheet_data))
+        analysis = {
+            'header_rows': header_rows,
+            'sections': sections,
+            'tables': {}
+        }
+        self._analysis_cache[key] = (grid, [list(row) for row in grid],
+                                     [dict(merged) for merged in merged_cells], analysis)
+        self._analysis_cache.move_to_end(key)
+        if len(self._analysis_cache) > self.ANALYSIS_CACHE_SIZE:
+            self._analysis_cache.popitem(last=False)
+        return analysis
+    
+    def _identify_sections(self, grid: List[List[str]], merged_cells: List[Dict],
+                           nonempty_counts: Optional[List[int]] = None) -> Tuple[set, List[Tuple[str, int, int]]]:
         """
         Identify header rows and data table sections
         Returns: (header_rows_set, sections_list)
         """
-        header_rows = set()
-        sections = []
+        if nonempty_counts is None:
+            nonempty_counts = self._count_nonempty_cells(grid)
+        
+        # Find rows that are mostly empty or have very few cells
+        header_mask = [0 < non_empty_cells <= 2 for non_empty_cells in nonempty_counts]
         
         # Find rows with large merged cells (likely headers)
         for merged in merged_cells:
-            start_row = merged['start_row'] - 1  # Convert to 0-based
-            end_row = merged['end_row'] - 1
             cols_span = merged['end_col'] - merged['start_col'] + 1
             
             # If merged cell spans many columns (>= 3), consider it a header
             if cols_span >= 3:
-                for row in range(start_row, end_row + 1):
-                    header_rows.add(row)
+                start_row = merged['start_row'] - 1  # Convert to 0-based
+                end_row = min(merged['end_row'], len(header_mask))
+                header_mask[start_row:end_row] = [True] * max(end_row - start_row, 0)
         
-        # Find rows that are mostly empty or have very few cells
-        for row_idx, row in enumerate(grid):
-            non_empty_cells = sum(1 for cell in row if cell.strip())
-            if non_empty_cells <= 2 and non_empty_cells > 0:
-                header_rows.add(row_idx)
+        header_rows = {row_idx for row_idx, is_header in enumerate(header_mask) if is_header}
+        return header_rows, self._scan_sections(nonempty_counts, header_mask)
+    
+    def _scan_sections(self, nonempty_counts: List[int], header_mask: List[bool]) -> List[Tuple[str, int, int]]:
+        """
+        Split rows into header and table sections from the per-row counts alone
+        """
+        sections = []
         
         # Identify table sections (consecutive rows with many columns)
         current_section_start = None
         current_section_type = None
         
-        for row_idx, row in enumerate(grid):
-            non_empty_cells = sum(1 for cell in row if cell.strip())
-            
-            if row_idx in header_rows:
+        for row_idx, non_empty_cells in enumerate(nonempty_counts):
+            if header_mask[row_idx]:
                 # This is a header row
                 if current_section_type == 'table' and current_section_start is not None:
                     sections.append(('table', current_section_start, row_idx - 1))
@@ -368,25 +1002,19 @@ class EnhancedExcelExtractor:
         
         # Close final section
         if current_section_start is not None:
-            sections.append((current_section_type, current_section_start, len(grid) - 1))
+            sections.append((current_section_type, current_section_start, len(nonempty_counts) - 1))
         
-        return header_rows, sections
+        return sections
     
-    def _format_header_row(self, row: List[str], row_idx: int, merged_cells: List[Dict]) -> str:
+    def _format_header_row(self, row: List[str], row_idx: int, merged_by_row: Dict[int, List[Dict]]) -> str:
         """
         Format a header row as plain text
         """
-        # Find merged cells in this row
-        row_merged_cells = []
-        for merged in merged_cells:
-            if merged['start_row'] - 1 <= row_idx <= merged['end_row'] - 1:
-                row_merged_cells.append(merged)
-        
-        # If there are large merged cells, use their values
-        for merged in row_merged_cells:
+        # If there are large merged cells in this row, use their values
+        for merged in merged_by_row.get(row_idx, ()):
             cols_span = merged['end_col'] - merged['start_col'] + 1
             if cols_span >= 3:  # Large merged cell
-                text = merged['value'].strip()
+                text = merged['value']
                 if text:
                     # Determine header level based on span
                     if cols_span >= 10:
@@ -397,13 +1025,15 @@ class EnhancedExcelExtractor:
                         return f"### {text}"
         
         # Otherwise, concatenate non-empty cells
-        non_empty_cells = [cell.strip() for cell in row if cell.strip()]
+        non_empty_cells = [cell for cell in row if cell]
         if non_empty_cells:
             return f"**{' - '.join(non_empty_cells)}**"
         
         return ""
     
-    def _format_table_section(self, grid: List[List[str]], start_row: int, end_row: int, merged_cells: List[Dict]) -> List[str]:
+    def _format_table_section(self, grid: List[List[str]], start_row: int, end_row: int,
+                              merged_by_anchor: Dict[Tuple[int, int], Dict],
+                              merged_anchor_rows: Dict[int, List[Optional[Tuple[int, int]]]]) -> List[str]:
         """
         Format a table section as markdown table
         """
@@ -413,88 +1043,77 @@ class EnhancedExcelExtractor:
         table_lines = []
         
         # Find the maximum number of non-empty columns in this section
+        # (scan each row from the right, only over columns past the current width)
         max_cols = 0
-        for row_idx in range(start_row, end_row + 1):
-            row = grid[row_idx]
-            last_non_empty = -1
-            for col_idx, cell in enumerate(row):
-                if cell.strip():
-                    last_non_empty = col_idx
-            max_cols = max(max_cols, last_non_empty + 1)
+        for row in grid[start_row:end_row + 1]:
+            for col_idx in range(len(row) - 1, max_cols - 1, -1):
+                if row[col_idx]:
+                    max_cols = col_idx + 1
+                    break
         
         if max_cols == 0:
             return []
         
-        # Create merged cell lookup for this section
-        section_merged = {}
-        for merged in merged_cells:
-            for row in range(merged['start_row'] - 1, merged['end_row']):
-                for col in range(merged['start_col'] - 1, merged['end_col']):
-                    if start_row <= row <= end_row:
-                        section_merged[(row, col)] = merged['value']
-        
-        # Generate table rows
-        processed_rows = []
+        # Generate table rows, emitting each markdown line as soon as it is built
+        separator = "| " + " | ".join(["---"] * max_cols) + " |"
         for row_idx in range(start_row, end_row + 1):
             row = grid[row_idx]
-            table_row = []
-            
-            for col_idx in range(max_cols):
-                if (row_idx, col_idx) in section_merged:
-                    # Use merged cell value
-                    cell_value = section_merged[(row_idx, col_idx)]
-                elif col_idx < len(row):
-                    # Use regular cell value
-                    cell_value = row[col_idx]
-                else:
-                    cell_value = ""
-                
-                # Clean up cell value
-                cell_value = cell_value.strip().replace('|', '\\|')  # Escape pipes
-                if not cell_value:
-                    cell_value = " "
-                
-                table_row.append(cell_value)
-            
-            processed_rows.append(table_row)
-        
-        # Create markdown table
-        if processed_rows:
-            # Header row
-            header_row = "| " + " | ".join(processed_rows[0]) + " |"
-            table_lines.append(header_row)
+            table_row = row[:max_cols]
+            if len(table_row) < max_cols:
+                table_row += [''] * (max_cols - len(table_row))
             
-            # Separator row
-            separator = "| " + " | ".join(["---"] * max_cols) + " |"
-            table_lines.append(separator)
+            # Use merged cell values where the row is covered by a merge
+            anchors = merged_anchor_rows.get(row_idx)
+            if anchors:
+                table_row = [cell if anchor is None else merged_by_anchor[anchor]['value']
+                             for cell, anchor in zip(table_row, anchors)]
             
-            # Data rows
-            for row in processed_rows[1:]:
-                data_row = "| " + " | ".join(row) + " |"
-                table_lines.append(data_row)
+            # Escape pipes and keep multi-line cells on one table row
+            table_lines.append("| " + " | ".join(
+                [cell.replace('|', '\\|').replace('\n', '<br/>') if cell else " " for cell in table_row]
+            ) + " |")
+            if row_idx == start_row:
+                table_lines.append(separator)
         
-        return table_lines 
+        return table_lines
     
     def to_llm_optimized(self, extracted_data: Dict[str, Any]) -> str:
         """
         Convert to LLM-optimized format preserving Excel structure and order
         """
-        content_parts = []
+        buf = io.StringIO()
+        self.write_llm_optimized(extracted_data, buf)
+        return buf.getvalue()
+    
+    def to_llm_optimized_to_file(self, extracted_data: Dict[str, Any], output_path: str,
+                                 wrapper: Optional[Callable[[TextIO], TextIO]] = None) -> TextIO:
+        """
+        Write the LLM-optimized format straight to a file, without building
+        the whole output string in memory first. wrapper, if given, wraps the
+        opened file (e.g. to count what is written); the stream written to is
+        returned
+        """
+        with open(output_path, 'w', encoding='utf-8', buffering=self.OUTPUT_BUFFER_SIZE) as f:
+            out = wrapper(f) if wrapper else f
+            self.write_llm_optimized(extracted_data, out)
+        return out
+    
+    def write_llm_optimized(self, extracted_data: Dict[str, Any], out: TextIO):
+        """
+        Write the LLM-optimized format to an open text stream, piece by piece
+        """
+        lines = _LineWriter(out, strip=True)
         
         # Process each sheet
         for sheet_name, sheet_data in extracted_data['sheets'].items():
             grid = sheet_data['grid']
             merged_cells = sheet_data['merged_cells']
-            
-            # Create a merged cells map for easy lookup by position
-            merged_map = {}
-            for merged in merged_cells:
-                for row in range(merged['start_row'] - 1, merged['end_row']):
-                    for col in range(merged['start_col'] - 1, merged['end_col']):
-                        merged_map[(row, col)] = merged['value']
+            merged_by_anchor, merged_anchor_rows, _ = self._get_merged_index(sheet_data)
+            nonempty_counts = self._get_nonempty_counts(sheet_data)
             
             # Process Excel from top to bottom, maintaining original structure
             current_section = []
+            current_section_seen = set()  # Mirrors current_section for O(1) dedup
             table_processed = False
             skip_until_row = -1  # Track which rows to skip after table processing
             
@@ -506,71 +1125,78 @@ class EnhancedExcelExtractor:
                     continue
                     
                 row = grid[row_idx]
+                anchors = merged_anchor_rows.get(row_idx)
                 
                 # Check if this is a merged cell row that spans many columns (header/title)
                 is_title_row = False
                 row_content = []
                 
-                for col_idx, cell in enumerate(row):
-                    if (row_idx, col_idx) in merged_map:
-                        # This cell is part of a merged area
-                        merged_value = merged_map[(row_idx, col_idx)]
-                        if merged_value and str(merged_value).strip():
-                            # Find the size of this merged area
-                            matching_merged = None
-                            for merged in merged_cells:
-                                if (merged['start_row'] - 1 <= row_idx < merged['end_row'] and 
-                                    merged['start_col'] - 1 <= col_idx < merged['end_col']):
-                                    matching_merged = merged
-                                    break
-                            
-                            if matching_merged:
+                if anchors is None:
+                    # Fast path - no merge touches this row, so an empty row
+                    # contributes nothing and the cells can be taken as they are
+                    if not nonempty_counts[row_idx]:
+                        row_idx += 1
+                        continue
+                    row_content = [cell if cell != 'None' else "" for cell in row]
+                else:
+                    for col_idx, cell in enumerate(row):
+                        anchor = anchors[col_idx]
+                        if anchor is not None:
+                            # This cell is part of a merged area
+                            matching_merged = merged_by_anchor[anchor]
+                            merged_value = matching_merged['value']
+                            if merged_value:
+                                # The size of this merged area
                                 cols_span = matching_merged['end_col'] - matching_merged['start_col'] + 1
                                 # If merged cell spans many columns, treat as title/header
                                 if cols_span >= 6:
                                     is_title_row = True
-                                    if str(merged_value).strip() not in [item.strip() for item in current_section]:
-                                        current_section.append(str(merged_value).strip())
+                                    if merged_value not in current_section_seen:
+                                        current_section_seen.add(merged_value)
+                                        current_section.append(merged_value)
                                 else:
                                     # Small merged cell, treat as regular data
-                                    row_content.append(str(merged_value).strip())
-                            break  # Skip other cells in this merged area
-                    elif cell and str(cell).strip() and str(cell).strip() != 'None':
-                        row_content.append(str(cell).strip())
-                    else:
-                        row_content.append("")
+                                    row_content.append(merged_value)
+                                break  # Skip other cells in this merged area
+                        elif cell and cell != 'None':
+                            row_content.append(cell)
+                        else:
+                            row_content.append("")
                 
                 # If it's not a title row, check if it's a table row
                 if not is_title_row and row_content:
                     # Count non-empty cells to determine if this looks like a data table
-                    non_empty_count = sum(1 for item in row_content if item.strip())
+                    non_empty_count = sum(1 for item in row_content if item)
                     
                     if non_empty_count >= 5 and not table_processed:  # Likely a table row and haven't processed table yet
                         # This might be start of a table - check if we have accumulated section content
                         if current_section:
                             # Add section headers
                             for item in current_section:
-                                content_parts.append(item)
-                            content_parts.append("")  # Blank line after headers
+                                lines.write(item)
+                            lines.write("")  # Blank line after headers
                             current_section = []
+                            current_section_seen = set()
                         
                         # Start processing table
-                        table_content = self._extract_table_from_position(grid, merged_cells, row_idx)
+                        table_content, table_end_row = self._extract_table_from_position(
+                            grid, merged_cells, row_idx, nonempty_counts)
                         if table_content:
-                            content_parts.extend(table_content)
-                            content_parts.append("")  # Blank line after table
+                            lines.writelines(table_content)
+                            lines.write("")  # Blank line after table
                             table_processed = True
                             
-                            # Calculate exactly which rows were consumed by table processing
-                            table_end_row = self._find_table_end(grid, row_idx)
-                            skip_until_row = table_end_row  # Skip all rows processed by table
+                            # Skip exactly the rows consumed by table processing
+                            skip_until_row = table_end_row
                             
                     else:
                         # Regular content row - collect it
                         if non_empty_count >= 1:  # Any meaningful content
-                            row_text = " ".join(item for item in row_content if item.strip())
-                            if row_text.strip() and len(row_text.strip()) > 1:
-                                current_section.append(row_text.strip())
+                            row_text = " ".join(item for item in row_content if item)
+                            if len(row_text) > 1 and not (self.collapse_repeated_rows
+                                                          and row_text in current_section_seen):
+                                current_section_seen.add(row_text)
+                                current_section.append(row_text)
                 
                 row_idx += 1
             
@@ -578,45 +1204,28 @@ class EnhancedExcelExtractor:
             if current_section:
                 # Check if we need a section header
                 if table_processed and current_section:
-                    content_parts.append("**Phạm vi báo cáo:**")
-                    content_parts.append("")
+                    lines.write("**Phạm vi báo cáo:**")
+                    lines.write("")
                 
                 for item in current_section:
-                    content_parts.append(item)
-        
-        return "\n".join(content_parts).strip()
+                    lines.write(item)
     
-    def _extract_table_from_position(self, grid: List[List[str]], merged_cells: List[Dict], start_row: int) -> List[str]:
+    def _extract_table_from_position(self, grid: List[List[str]], merged_cells: List[Dict], start_row: int,
+                                     nonempty_counts: Optional[List[int]] = None) -> Tuple[List[str], int]:
         """
         Extract a well-formatted table starting from the given position
+        Returns: (table_lines, table_end_row)
         """
+        if nonempty_counts is None:
+            nonempty_counts = self._count_nonempty_cells(grid)
+        
         table_lines = []
         
         # Find the extent of this table
-        table_end_row = start_row
-        max_cols = 0
-        
-        # Determine table boundaries
-        for row_idx in range(start_row, len(grid)):
-            row = grid[row_idx]
-            non_empty_count = sum(1 for cell in row if cell and str(cell).strip() and str(cell).strip() != 'None')
-            
-            if non_empty_count >= 3:  # Continue table
-                table_end_row = row_idx
-                max_cols = max(max_cols, len([cell for cell in row if cell and str(cell).strip()]))
-            elif non_empty_count == 0:
-                # Empty row might indicate end of table
-                # Check next row to be sure
-                if row_idx + 1 < len(grid):
-                    next_row = grid[row_idx + 1]
-                    next_non_empty = sum(1 for cell in next_row if cell and str(cell).strip() and str(cell).strip() != 'None')
-                    if next_non_empty < 3:
-                        break  # End of table
-                else:
-                    break
+        table_end_row = self._find_table_end(grid, nonempty_counts, start_row)
         
         if table_end_row <= start_row:
-            return []
+            return [], table_end_row
         
         # Extract table headers (first row) - ONLY non-empty columns
         header_row = grid[start_row]
@@ -624,16 +1233,17 @@ class EnhancedExcelExtractor:
         header_column_indices = []  # Track which original columns we keep
         
         for col_idx, cell in enumerate(header_row):
-            if cell and str(cell).strip() and str(cell).strip() != 'None':
-                headers.append(str(cell).strip())
+            if cell and cell != 'None':
+                headers.append(cell)
                 header_column_indices.append(col_idx)
         
         if not headers:
-            return []
+            return [], table_end_row
         
-        # Create markdown table with ONLY meaningful columns
-        table_lines.append("| " + " | ".join(headers) + " |")
-        table_lines.append("| " + " | ".join(["---"] * len(headers)) + " |")
+        # Identical rows in a run are counted and written once (collapse_repeated_rows)
+        collapse = self.collapse_repeated_rows
+        data_rows = []
+        counts = []
         
         # Add data rows - use SAME column indices as headers
         for row_idx in range(start_row + 1, table_end_row + 1):
@@ -642,8 +1252,8 @@ class EnhancedExcelExtractor:
             
             # Extract data ONLY from columns that have headers
             for col_idx in header_column_indices:
-                if col_idx < len(row) and row[col_idx] and str(row[col_idx]).strip() and str(row[col_idx]).strip() != 'None':
-                    cell_content = str(row[col_idx]).strip()
+                if col_idx < len(row) and row[col_idx] and row[col_idx] != 'None':
+                    cell_content = row[col_idx]
                     # Handle multiline content in cells
                     cell_content = cell_content.replace('\n', '<br/>')
                     row_data.append(cell_content)
@@ -651,32 +1261,53 @@ class EnhancedExcelExtractor:
                     row_data.append("")
             
             # Only add row if it has some content
-            if any(cell.strip() for cell in row_data):
+            if any(row_data):
                 # Replace empty cells with "-" for better table formatting
-                display_row = [cell if cell.strip() else "-" for cell in row_data]
-                table_lines.append("| " + " | ".join(display_row) + " |")
+                display_row = [cell if cell else "-" for cell in row_data]
+                if collapse:
+                    if display_row == headers:
+                        # Header repeated further down, e.g. at each printed page
+                        continue
+                    if data_rows and display_row == data_rows[-1]:
+                        counts[-1] += 1
+                        continue
+                data_rows.append(display_row)
+                counts.append(1)
+        
+        # Run lengths go in their own trailing column, so no data cell changes
+        if collapse and any(count > 1 for count in counts):
+            headers = headers + ["×"]
+            data_rows = [display_row + [f"×{count}" if count > 1 else "-"]
+                         for display_row, count in zip(data_rows, counts)]
         
-        return table_lines
+        # Create markdown table with ONLY meaningful columns
+        table_lines.append("| " + " | ".join(headers) + " |")
+        table_lines.append("| " + " | ".join(["---"] * len(headers)) + " |")
+        table_lines.extend("| " + " | ".join(display_row) + " |" for display_row in data_rows)
+        
+        return table_lines, table_end_row
     
-    def _find_table_end(self, grid: List[List[str]], start_row: int) -> int:
+    def _find_table_end(self, grid: List[List[str]], nonempty_counts: List[int], start_row: int) -> int:
         """
-        Find where the table ends
+        Find where the table ends, from the per-row counts
         """
+        def table_cells(row_idx: int) -> int:
+            # Cells holding the literal text 'None' don't count as table data
+            count = nonempty_counts[row_idx]
+            return count - grid[row_idx].count('None') if count else 0
+        
         table_end_row = start_row
         
-        for row_idx in range(start_row, len(grid)):
-            row = grid[row_idx]
-            non_empty_count = sum(1 for cell in row if cell and str(cell).strip() and str(cell).strip() != 'None')
+        for row_idx in range(start_row, len(nonempty_counts)):
+            non_empty_count = table_cells(row_idx)
             
             if non_empty_count >= 3:  # Continue table
                 table_end_row = row_idx
             elif non_empty_count == 0:
                 # Empty row might indicate end of table
                 # Check next row to be sure
-                if row_idx + 1 < len(grid):
-                    next_row = grid[row_idx + 1]
-                    next_non_empty = sum(1 for cell in next_row if cell and str(cell).strip() and str(cell).strip() != 'None')
-                    if next_non_empty < 3:
+                if row_idx + 1 < len(nonempty_counts):
+                    if table_cells(row_idx + 1) < 3:
                         break  # End of table
                 else:
                     break
@@ -689,36 +1320,35 @@ class EnhancedExcelExtractor:
         
         for merged in merged_cells:
             cols_span = merged['end_col'] - merged['start_col'] + 1
-            value = merged['value'].strip()
+            value = merged['value']
             
             if cols_span >= 6 and value:  # Large merged cells likely contain metadata
-                if 'ngân hàng' in value.lower():
-                    metadata['Bank'] = value
-                elif 'chi nhánh' in value.lower():
-                    metadata['Branch'] = value.replace('Chi nhánh:', '').strip()
-                elif 'phòng' in value.lower():
-                    metadata['Department'] = value.replace('Phòng:', '').strip()
-                elif 'ngày' in value.lower() and 'giờ' in value.lower():
-                    metadata['Print Date'] = value.replace('Ngày giờ in:', '').strip()
-                elif 'bảng kê' in value.lower() or 'báo cáo' in value.lower():
-                    metadata['Report Title'] = value
+                value_lower = value.lower()
+                # First matching rule wins
+                for keywords, key, label in self.METADATA_RULES:
+                    if all(keyword in value_lower for keyword in keywords):
+                        metadata[key] = value.replace(label, '').strip() if label else value
+                        break
         
         return metadata
     
-    def _identify_clean_data_tables(self, grid: List[List[str]], merged_cells: List[Dict]) -> List[Dict]:
+    def _identify_clean_data_tables(self, grid: List[List[str]], merged_cells: List[Dict],
+                                    nonempty_counts: Optional[List[int]] = None) -> List[Dict]:
         """Identify actual data tables (not metadata)"""
         tables = []
         
-        # Find rows with many non-empty columns (likely data)
-        potential_table_rows = []
-        for row_idx, row in enumerate(grid):
-            non_empty = sum(1 for cell in row if cell.strip())
-            if non_empty >= 5:  # Tables typically have many columns
-                potential_table_rows.append(row_idx)
+        if nonempty_counts is None:
+            nonempty_counts = self._count_nonempty_cells(grid)
+        
+        # Find rows with many non-empty columns (likely data);
+        # tables typically have many columns
+        potential_table_rows = [row_idx for row_idx, non_empty in enumerate(nonempty_counts) if non_empty >= 5]
         
         if not potential_table_rows:
             return tables
         
+        title_candidates = self._index_table_titles(merged_cells)
+        
         # Group consecutive rows into tables
         current_table_start = potential_table_rows[0]
         current_table_end = potential_table_rows[0]
@@ -730,7 +1360,7 @@ class EnhancedExcelExtractor:
                 # End current table, start new one
                 if current_table_end - current_table_start >= 1:  # At least 2 rows
                     # Find title from merged cells above this table
-                    title = self._find_table_title(current_table_start, merged_cells)
+                    title = self._find_table_title(current_table_start, title_candidates)
                     tables.append({
                         'title': title,
                         'start_row': current_table_start,
@@ -742,7 +1372,7 @@ class EnhancedExcelExtractor:
         
         # Add final table
         if current_table_end - current_table_start >= 1:
-            title = self._find_table_title(current_table_start, merged_cells)
+            title = self._find_table_title(current_table_start, title_candidates)
             tables.append({
                 'title': title,
                 'start_row': current_table_start,
@@ -751,17 +1381,29 @@ class EnhancedExcelExtractor:
         
         return tables
     
-    def _find_table_title(self, table_start_row: int, merged_cells: List[Dict]) -> str:
+    def _index_table_titles(self, merged_cells: List[Dict]) -> Dict[int, List[Tuple[int, str]]]:
+        """
+        Merged cells that could title a table, by 0-based start row,
+        as (position in merged_cells, value) in merged_cells order
+        """
+        candidates = {}
+        for position, merged in enumerate(merged_cells):
+            cols_span = merged['end_col'] - merged['start_col'] + 1
+            value = merged['value']
+            # Reasonably wide merged cell with meaningful text
+            if cols_span >= 3 and value and len(value) > 5:
+                candidates.setdefault(merged['start_row'] - 1, []).append((position, value))
+        return candidates
+    
+    def _find_table_title(self, table_start_row: int, title_candidates: Dict[int, List[Tuple[int, str]]]) -> str:
         """Find title for a data table from nearby merged cells"""
-        # Look for merged cells in the 5 rows above the table
-        for merged in merged_cells:
-            if (merged['start_row'] - 1 >= table_start_row - 5 and 
-                merged['start_row'] - 1 < table_start_row):
-                cols_span = merged['end_col'] - merged['start_col'] + 1
-                if cols_span >= 3:  # Reasonably wide merged cell
-                    value = merged['value'].strip()
-                    if value and len(value) > 5:  # Meaningful text
-                        return value
+        # Look for merged cells in the 5 rows above the table; the earliest
+        # one in merged_cells order wins
+        nearby = [title_candidates[row_idx][0]
+                  for row_idx in range(table_start_row - 5, table_start_row)
+                  if row_idx in title_candidates]
+        if nearby:
+            return min(nearby)[1]
         
         return "Data Table"
     
@@ -779,9 +1421,9 @@ class EnhancedExcelExtractor:
         seen_headers = set()
         
         for col_idx, cell in enumerate(header_row):
-            if cell.strip():
+            if cell:
                 # Clean header name
-                clean_header = cell.strip()
+                clean_header = cell
                 # Remove duplicate markers like "_A", "_B" 
                 base_header = clean_header.replace('_A', '').replace('_B', '').strip()
                 
@@ -806,71 +1448,60 @@ class EnhancedExcelExtractor:
         separator = "| " + " | ".join(["---"] * len(headers)) + " |"
         table_lines.append(separator)
         
-        # Data rows
-        for row_idx in range(start_row + 1, end_row + 1):
-            if row_idx < len(grid):
-                row = grid[row_idx]
-                data_cells = []
-                
-                for col_info in clean_columns:
-                    col_idx = col_info['original_col']
-                    if col_idx < len(row):
-                        cell_value = row[col_idx].strip()
-                        # Clean up cell value
-                        if not cell_value or cell_value.lower() == 'none':
-                            cell_value = "-"
-                        else:
-                            # Remove line breaks and clean
-                            cell_value = cell_value.replace('\n', ' ').strip()
-                            # Escape pipes
-                            cell_value = cell_value.replace('|', '\\|')
-                        data_cells.append(cell_value)
-                    else:
-                        data_cells.append("-")
-                
-                # Only add row if it has meaningful data
-                if any(cell != "-" for cell in data_cells):
-                    data_line = "| " + " | ".join(data_cells) + " |"
-                    table_lines.append(data_line)
+        # Data rows, taken from the same original columns as the headers
+        col_indices = [col['original_col'] for col in clean_columns]
+        width = col_indices[-1] + 1
+        for row in grid[start_row + 1:end_row + 1]:
+            # Pad short rows once so the column lookups need no bounds checks
+            if len(row) < width:
+                row = row + [''] * (width - len(row))
+            
+            # Clean up cell values: blanks become "-", line breaks are
+            # flattened and pipes escaped. Grid cells are stored stripped
+            # and inner line breaks stay inner, so no strip() is needed
+            data_cells = ["-" if not value or value.lower() == 'none'
+                          else value.replace('\n', ' ').replace('|', '\\|')
+                          for value in [row[col_idx] for col_idx in col_indices]]
+            
+            # Only add row if it has meaningful data
+            if any(cell != "-" for cell in data_cells):
+                table_lines.append("| " + " | ".join(data_cells) + " |")
         
         return table_lines
     
     def _extract_business_rules(self, grid: List[List[str]], merged_cells: List[Dict]) -> List[str]:
         """Extract business rules and formulas"""
-        rules = []
+        rules = {}  # Insertion-ordered, so it doubles as an ordered set
         
         # Look for cells containing logical expressions or formulas
         for row in grid:
             for cell in row:
-                if cell and cell.strip():
-                    cell_content = cell.strip()
-                    # Look for conditional logic
-                    if ('IF ' in cell_content.upper() or 
-                        'THEN' in cell_content.upper() or
-                        'ELSE' in cell_content.upper() or
-                        '=' in cell_content and 'LNP' in cell_content.upper()):
-                        if cell_content not in rules:
-                            rules.append(cell_content)
-                    # Look for UNION operations
-                    elif 'UNION' in cell_content.upper():
-                        if cell_content not in rules:
-                            rules.append(cell_content)
-        
-        return rules
+                if cell:
+                    # Conditional logic, UNION operations or LNP formulas
+                    cell_upper = cell.upper()
+                    if _RULE_KEYWORDS_RE.search(cell_upper) or ('=' in cell and 'LNP' in cell_upper):
+                        rules[cell] = None
+        
+        return list(rules)
     
     def _extract_scope_information(self, grid: List[List[str]]) -> List[str]:
         """Extract report scope and context information"""
-        scope_info = []
+        scope_info = {}  # Insertion-ordered, so it doubles as an ordered set
         
         for row in grid:
             for cell in row:
-                if cell and cell.strip():
-                    cell_content = cell.strip()
-                    # Look for scope definitions
-                    if ('phạm vi' in cell_content.lower() or
-                        'bản ghi' in cell_content.lower() or
-                        'key:' in cell_content.lower()):
-                        if cell_content not in scope_info:
-                            scope_info.append(cell_content)
-        
-        return scope_info 
\ No newline at end of file
+                # Look for scope definitions
+                if cell and _SCOPE_KEYWORDS_RE.search(cell.lower()):
+                    scope_info[cell] = None
+        
+        return list(scope_info)
+
+def _extract_sheet_worker(args: Tuple[str, str]) -> Dict[str, Any]:
+    """Extract one sheet in a worker process, used by extract(max_workers=N)"""
+    file_path, sheet_name = args
+    extractor = EnhancedExcelExtractor()
+    workbook = extractor._open_workbook(file_path)
+    try:
+        return extractor._extract_sheet_by_name(workbook, sheet_name)
+    finally:
+        workbook['archive'].close()
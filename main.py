@@ -6,10 +6,12 @@ Converts Excel files to LLM-friendly format with minimal noise and maximum clari
 
 import sys
 import os
-from pathlib import Path
+import io
+import contextlib
+from urllib.parse import urlparse
 from enhanced_excel_extractor import EnhancedExcelExtractor
-from docling_extractor import DoclingExtractor
-from typing import Optional
+from docling_extractor import DoclingExtractor, is_url
+from typing import Optional, Tuple
 
 def print_banner():
     """Print application banner"""
@@ -22,18 +24,57 @@ def print_usage():
     """Print usage instructions"""
     print("\nUsage:")
     print("  python main.py <excel_file> [output_file]")
+    print("  python main.py <document_url> [output_file]")
     print("  python main.py --demo")
+    print("\nOptions (PDF/Word/URL inputs):")
+    print("  --accurate  OCR and accurate table recognition (slower)")
+    print("  --ocr       OCR with fast table recognition, e.g. for scanned PDFs")
     print("\nExamples:")
     print("  python main.py report.xlsx")
     print("  python main.py report.xlsx analysis.md")
+    print("  python main.py https://example.com/report.pdf")
+    print("  python main.py scanned.pdf --ocr")
     print("  python main.py --demo")
     print("\nOutput Format:")
     print("  📋 LLM-Optimized: Clean structure, no duplicates, clear context")
     print("  📄 Markdown format for easy LLM consumption")
 
-def process_excel_for_llm(input_file: str, output_file: Optional[str] = None) -> bool:
+class CountingWriter:
     """
-    Process Excel file specifically for LLM consumption
+    Pass text through to a file while counting characters and whitespace
+    separated words, keeping the first characters for a preview
+    """
+    
+    def __init__(self, out, preview_size: int = 500):
+        self.out = out
+        self.preview_size = preview_size
+        self.preview = ''
+        self.chars = 0
+        self.words = 0
+        self._in_word = False
+    
+    def write(self, text: str):
+        self.out.write(text)
+        if not text:
+            return
+        self.chars += len(text)
+        if len(self.preview) < self.preview_size:
+            self.preview += text[:self.preview_size - len(self.preview)]
+        words = len(text.split())
+        # A word cut across two writes was already counted
+        if words and self._in_word and not text[0].isspace():
+            words -= 1
+        self.words += words
+        self._in_word = not text[-1].isspace()
+
+def process_excel_for_llm(input_file: str, output_file: Optional[str] = None,
+                          base_name: Optional[str] = None, max_workers: Optional[int] = None,
+                          show_preview: Optional[bool] = None) -> bool:
+    """
+    Process Excel file specifically for LLM consumption. base_name is the
+    input path without its extension, when the caller has already split it.
+    max_workers caps the sheet worker processes (default: one per core);
+    show_preview defaults to whether stdout is a terminal
     """
     try:
         print(f"🔍 Analyzing Excel file: {input_file}")
@@ -41,38 +82,45 @@ def process_excel_for_llm(input_file: str, output_file: Optional[str] = None) ->
         # Use Enhanced Excel Extractor for maximum control
         extractor = EnhancedExcelExtractor()
         
-        # Extract content with full structure preservation
-        extracted_data = extractor.extract(input_file)
+        # Extract content with full structure preservation; sheets of
+        # multi-sheet workbooks are parsed in parallel when cores allow
+        if max_workers is None:
+            max_workers = os.cpu_count()
+        extracted_data = extractor.extract(input_file, max_workers=max_workers)
         print(f"✅ Extracted {extracted_data['metadata']['sheets_count']} sheets")
-        print(f"📊 Found {sum(len(sheet['merged_cells']) for sheet in extracted_data['sheets'].values())} merged cells")
-        
-        # Convert to LLM-optimized format
-        print("🤖 Converting to LLM-optimized format...")
-        llm_content = extractor.to_llm_optimized(extracted_data)
+        print(f"📊 Found {extracted_data['metadata']['total_merged_cells']} merged cells")
         
         # Generate output filename if not provided
         if not output_file:
-            base_name = os.path.splitext(input_file)[0]
+            if base_name is None:
+                base_name = os.path.splitext(input_file)[0]
             output_file = f"{base_name}_llm_optimized.md"
         
-        # Save results
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(llm_content)
+        # Convert to LLM-optimized format, streaming it straight into the
+        # output file and counting as it goes
+        print("🤖 Converting to LLM-optimized format...")
+        # The preview is only for someone watching a terminal, not for logs
+        if show_preview is None:
+            show_preview = sys.stdout.isatty()
+        llm_output = extractor.to_llm_optimized_to_file(
+            extracted_data, output_file,
+            wrapper=lambda f: CountingWriter(f, preview_size=500 if show_preview else 0))
         
         print(f"✅ LLM-optimized content saved to: {output_file}")
         
         # Show analysis preview
-        print("\n📖 Preview (first 500 characters):")
-        print("-" * 50)
-        preview = llm_content[:500]
-        if len(llm_content) > 500:
-            preview += "..."
-        print(preview)
+        if show_preview:
+            print("\n📖 Preview (first 500 characters):")
+            print("-" * 50)
+            preview = llm_output.preview
+            if llm_output.chars > 500:
+                preview += "..."
+            print(preview)
         
         # Show format benefits
         print(f"\n🎯 LLM Benefits:")
-        print(f"   📝 Content length: {len(llm_content):,} characters")
-        print(f"   📊 Estimated tokens: ~{len(llm_content.split()):,}")
+        print(f"   📝 Content length: {llm_output.chars:,} characters")
+        print(f"   📊 Estimated tokens: ~{llm_output.words:,}")
         print(f"   🧹 Pure Excel content: No section headers")
         print(f"   🚫 No duplicate columns or noise")
         
@@ -85,13 +133,17 @@ def process_excel_for_llm(input_file: str, output_file: Optional[str] = None) ->
         print(f"❌ Error processing file: {e}")
         return False
 
-def process_non_excel_file(input_file: str, output_file: Optional[str] = None) -> bool:
+def process_non_excel_file(input_file: str, output_file: Optional[str] = None,
+                           base_name: Optional[str] = None, mode: str = 'fast',
+                           do_ocr: Optional[bool] = None) -> bool:
     """
-    Process non-Excel files using standard Docling
+    Process non-Excel files using standard Docling. base_name is the input
+    path without its extension, when the caller has already split it; mode
+    and do_ocr are passed on to DoclingExtractor
     """
     try:
         print(f"🔍 Processing non-Excel file: {input_file}")
-        extractor = DoclingExtractor()
+        extractor = DoclingExtractor(mode=mode, do_ocr=do_ocr)
         
         if not extractor.is_supported_file(input_file):
             print(f"❌ Unsupported file format. Supported: {', '.join(extractor.get_supported_extensions())}")
@@ -99,11 +151,21 @@ def process_non_excel_file(input_file: str, output_file: Optional[str] = None) -
         
         # Extract content
         extracted_data = extractor.extract(input_file)
+        if (not extractor.do_ocr and do_ocr is None and not extracted_data['content'].strip()
+                and extracted_data['file_type'] in ('PDF', 'Image')):
+            # No text layer - most likely a scanned document, so retry with OCR
+            print("🔁 No text found, retrying with OCR...")
+            extractor = DoclingExtractor(mode=mode, do_ocr=True)
+            extracted_data = extractor.extract(input_file)
         content = extractor.to_markdown(extracted_data)
         
         # Generate output filename
         if not output_file:
-            base_name = os.path.splitext(input_file)[0]
+            if is_url(input_file):
+                # Name the output after the remote file, in the current directory
+                base_name = os.path.splitext(os.path.basename(urlparse(input_file).path))[0] or 'document'
+            elif base_name is None:
+                base_name = os.path.splitext(input_file)[0]
             output_file = f"{base_name}_extracted.md"
         
         # Save results
@@ -117,15 +179,28 @@ def process_non_excel_file(input_file: str, output_file: Optional[str] = None) -
         print(f"❌ Error: {e}")
         return False
 
-def run_demo():
-    """Demo with available sample files"""
+def _process_demo_excel_file(input_file: str, show_preview: bool) -> Tuple[bool, str]:
+    """Run process_excel_for_llm in a demo worker process, returning its result and console output"""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        # The files already run side by side, so sheets are parsed in this
+        # process rather than in a nested pool
+        success = process_excel_for_llm(input_file, max_workers=1, show_preview=show_preview)
+    return success, log.getvalue()
+
+def run_demo(mode: str = 'fast', do_ocr: Optional[bool] = None):
+    """Demo with available sample files; mode and do_ocr apply to the non-Excel files"""
     print("🧪 Demo Mode - Processing sample files...")
     
-    # Look for sample files
-    sample_files = []
-    for ext in ['.xlsx', '.xls', '.pdf', '.docx']:
-        for file in Path('.').glob(f'*{ext}'):
-            sample_files.append(str(file))
+    # Look for sample files in one pass over the directory, grouped by extension
+    sample_exts = ['.xlsx', '.xls', '.xlsb', '.pdf', '.docx']
+    files_by_ext = {ext: [] for ext in sample_exts}
+    with os.scandir('.') as entries:
+        for entry in entries:
+            ext = os.path.splitext(entry.name)[1]
+            if ext in files_by_ext and entry.is_file():
+                files_by_ext[ext].append(entry.name)
+    sample_files = [file for ext in sample_exts for file in files_by_ext[ext]]
     
     if not sample_files:
         print("❌ No sample files found.")
@@ -134,23 +209,40 @@ def run_demo():
     
     print(f"📁 Found {len(sample_files)} sample files:")
     
-    excel_files = [f for f in sample_files if f.endswith(('.xlsx', '.xls'))]
-    other_files = [f for f in sample_files if not f.endswith(('.xlsx', '.xls'))]
+    excel_files = [f for f in sample_files if f.endswith(('.xlsx', '.xls', '.xlsb'))]
+    other_files = [f for f in sample_files if not f.endswith(('.xlsx', '.xls', '.xlsb'))]
     
     # Process Excel files with LLM optimization
     if excel_files:
         print(f"\n🚀 Processing {len(excel_files)} Excel files with LLM optimization:")
-        for file in excel_files[:3]:  # Limit to 3 files
-            print(f"\n📊 Processing: {file}")
-            success = process_excel_for_llm(file)
-            print("✅ Success" if success else "❌ Failed")
+        demo_files = excel_files[:3]  # Limit to 3 files
+        workers = min(len(demo_files), os.cpu_count() or 1)
+        if workers > 1:
+            # Convert the files side by side; each file's messages are printed
+            # together, in file order, once it is done. Workers write to a
+            # buffer, so whether to preview is decided here
+            from concurrent.futures import ProcessPoolExecutor
+            
+            show_preview = sys.stdout.isatty()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(_process_demo_excel_file, demo_files,
+                                       [show_preview] * len(demo_files))
+                for file, (success, log) in zip(demo_files, results):
+                    print(f"\n📊 Processing: {file}")
+                    print(log, end='')
+                    print("✅ Success" if success else "❌ Failed")
+        else:
+            for file in demo_files:
+                print(f"\n📊 Processing: {file}")
+                success = process_excel_for_llm(file)
+                print("✅ Success" if success else "❌ Failed")
     
     # Process other files with standard extraction
     if other_files:
         print(f"\n📄 Processing {len(other_files)} other files with standard extraction:")
         for file in other_files[:3]:  # Limit to 3 files
             print(f"\n📄 Processing: {file}")
-            success = process_non_excel_file(file)
+            success = process_non_excel_file(file, mode=mode, do_ocr=do_ocr)
             print("✅ Success" if success else "❌ Failed")
     
     return True
@@ -159,32 +251,44 @@ def main():
     """Main entry point"""
     print_banner()
     
-    # Parse command line arguments
-    if len(sys.argv) < 2:
+    # Parse command line arguments; the Docling options may appear anywhere
+    args = sys.argv[1:]
+    mode = 'accurate' if '--accurate' in args else 'fast'
+    do_ocr = True if '--ocr' in args else None
+    args = [arg for arg in args if arg not in ('--accurate', '--ocr')]
+    if not args:
         print_usage()
         return
     
     # Handle demo mode
-    if sys.argv[1] == '--demo':
-        run_demo()
+    if args[0] == '--demo':
+        run_demo(mode, do_ocr)
         return
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else None
+    input_file = args[0]
+    output_file = args[1] if len(args) > 1 else None
+    
+    # Remote documents always go through Docling
+    if is_url(input_file):
+        print("📄 Mode: Standard Document Processing (URL)")
+        process_non_excel_file(input_file, output_file, mode=mode, do_ocr=do_ocr)
+        return
     
     if not os.path.exists(input_file):
         print(f"❌ Error: File '{input_file}' not found.")
         return
     
-    # Determine processing method based on file type
-    file_ext = os.path.splitext(input_file)[1].lower()
+    # Determine processing method based on file type; the base name is
+    # reused for the default output file
+    base_name, file_ext = os.path.splitext(input_file)
+    file_ext = file_ext.lower()
     
-    if file_ext in ['.xlsx', '.xls']:
+    if file_ext in ['.xlsx', '.xls', '.xlsb']:
         print("🎯 Mode: LLM-Optimized Excel Processing")
-        process_excel_for_llm(input_file, output_file)
+        process_excel_for_llm(input_file, output_file, base_name)
     else:
         print("📄 Mode: Standard Document Processing")
-        process_non_excel_file(input_file, output_file)
+        process_non_excel_file(input_file, output_file, base_name, mode, do_ocr)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,167 @@
+import http.server
+import os
+import threading
+import types
+
+import pytest
+
+import docling_extractor
+from docling_extractor import DoclingExtractor
+
+
+class _StubConverter:
+    """Stands in for Docling's DocumentConverter: returns the source bytes as markdown"""
+
+    def __init__(self):
+        self.sources = []
+
+    def convert(self, source):
+        self.sources.append(source)
+        text = source.decode('utf-8')
+        document = types.SimpleNamespace(export_to_markdown=lambda: f"# {text}",
+                                         page_count=1, tables=[], document_hash='')
+        return types.SimpleNamespace(document=document, processing_time_seconds=0.0)
+
+
+@pytest.fixture(params=['msgpack', 'json'])
+def converter(request, monkeypatch):
+    if request.param == 'msgpack':
+        pytest.importorskip('msgpack')
+        pytest.importorskip('zstandard')
+    else:
+        monkeypatch.setattr(docling_extractor, 'msgpack', None)
+        monkeypatch.setattr(docling_extractor, 'zstandard', None)
+
+    stub = _StubConverter()
+    monkeypatch.setattr(docling_extractor, '_CONVERTER_CACHE', {})
+    monkeypatch.setattr(DoclingExtractor, '_create_converter', lambda self: stub)
+    # Hand the read bytes straight to the stub instead of a Docling DocumentStream
+    monkeypatch.setattr(DoclingExtractor, '_get_source', lambda self, file_path, raw: raw)
+    return stub
+
+
+@pytest.fixture
+def server():
+    """Local HTTP server for one document, answering If-None-Match with 304"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            state['requests'].append(dict(self.headers))
+            if self.headers.get('If-None-Match') == state['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', state['etag'])
+            self.send_header('Content-Length', str(len(state['body'])))
+            self.end_headers()
+            self.wfile.write(state['body'])
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+    state = {'body': b'%PDF remote', 'etag': '"v1"', 'requests': [],
+             'url': f"http://127.0.0.1:{httpd.server_port}/files/report.pdf"}
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _cache_entries(cache_dir):
+    return sorted(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else []
+
+
+def test_cache_miss_then_hit(converter, tmp_path):
+    path = tmp_path / 'report.pdf'
+    path.write_bytes(b'%PDF first')
+    cache_dir = str(tmp_path / 'cache')
+
+    first = DoclingExtractor(cache_dir=cache_dir).extract(str(path))
+    assert first['content'] == '# %PDF first'
+    assert first['file_type'] == 'PDF'
+    assert len(converter.sources) == 1
+    assert len(_cache_entries(cache_dir)) == 1
+
+    # A new extractor has an empty memo, so this is served from disk
+    extractor = DoclingExtractor(cache_dir=cache_dir)
+    assert extractor.extract(str(path)) == first
+    assert len(converter.sources) == 1
+
+    # With the entry gone the in-process memo still answers
+    os.unlink(os.path.join(cache_dir, _cache_entries(cache_dir)[0]))
+    assert extractor.extract(str(path)) == first
+    assert len(converter.sources) == 1
+
+
+def test_modified_file_is_converted_again(converter, tmp_path):
+    path = tmp_path / 'report.pdf'
+    path.write_bytes(b'%PDF first')
+    extractor = DoclingExtractor(cache_dir=str(tmp_path / 'cache'))
+    extractor.extract(str(path))
+
+    path.write_bytes(b'%PDF second, longer')
+    assert extractor.extract(str(path))['content'] == '# %PDF second, longer'
+    assert len(converter.sources) == 2
+    assert len(_cache_entries(str(tmp_path / 'cache'))) == 2
+
+
+def test_corrupt_entry_is_a_miss(converter, tmp_path):
+    path = tmp_path / 'report.pdf'
+    path.write_bytes(b'%PDF first')
+    cache_dir = str(tmp_path / 'cache')
+    DoclingExtractor(cache_dir=cache_dir).extract(str(path))
+
+    entry = os.path.join(cache_dir, _cache_entries(cache_dir)[0])
+    with open(entry, 'wb') as f:
+        f.write(b'\x00not a cache entry')
+
+    assert DoclingExtractor(cache_dir=cache_dir).extract(str(path))['content'] == '# %PDF first'
+    assert len(converter.sources) == 2
+    # The entry was rewritten and loads again
+    assert DoclingExtractor(cache_dir=cache_dir)._load_cached(entry)['content'] == '# %PDF first'
+
+
+def test_failed_cache_write_leaves_no_temp_file(converter, tmp_path, monkeypatch):
+    path = tmp_path / 'report.pdf'
+    path.write_bytes(b'%PDF first')
+    cache_dir = str(tmp_path / 'cache')
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'replace', fail)
+
+    result = DoclingExtractor(cache_dir=cache_dir).extract(str(path))
+    assert result['content'] == '# %PDF first'
+    assert _cache_entries(cache_dir) == []
+
+
+def test_unchanged_url_is_served_from_cache(converter, server, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+
+    first = DoclingExtractor(cache_dir=cache_dir).extract(server['url'])
+    assert first['filename'] == 'report.pdf'
+    assert first['file_type'] == 'PDF'
+    assert first['content'] == '# %PDF remote'
+    assert 'If-None-Match' not in server['requests'][0]
+
+    # The cached ETag is sent back and the 304 answer reuses the cached result
+    assert DoclingExtractor(cache_dir=cache_dir).extract(server['url']) == first
+    assert server['requests'][1]['If-None-Match'] == '"v1"'
+    assert len(converter.sources) == 1
+
+
+def test_changed_url_is_converted_again(converter, server, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    DoclingExtractor(cache_dir=cache_dir).extract(server['url'])
+
+    server['body'], server['etag'] = b'%PDF remote, updated', '"v2"'
+    result = DoclingExtractor(cache_dir=cache_dir).extract(server['url'])
+    assert result['content'] == '# %PDF remote, updated'
+    assert len(converter.sources) == 2
+
+    # The new ETag replaced the old one in the URL entry
+    DoclingExtractor(cache_dir=cache_dir).extract(server['url'])
+    assert server['requests'][-1]['If-None-Match'] == '"v2"'
+    assert len(converter.sources) == 2
@@ -0,0 +1,190 @@
+import copy
+import datetime
+import json
+import re
+import zipfile
+
+import openpyxl
+import pytest
+
+from enhanced_excel_extractor import EnhancedExcelExtractor
+
+
+def _save_patched(wb, path, patches):
+    """Save wb to path, applying {part name: (pattern, replacement)} regex edits to its XML"""
+    template = path.with_name('template.xlsx')
+    wb.save(template)
+    with zipfile.ZipFile(template) as zin, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for item in zin.infolist():
+            data = zin.read(item.filename)
+            if item.filename in patches:
+                pattern, replacement = patches[item.filename]
+                data, count = re.subn(pattern, replacement, data, count=1)
+                assert count == 1, item.filename
+            zout.writestr(item, data)
+    return str(path)
+
+
+@pytest.fixture(params=[True, False], ids=['fast_scan', 'iterparse'])
+def fast_scan(request, monkeypatch):
+    if not request.param:
+        # Send every sheet through iterparse
+        monkeypatch.setattr(EnhancedExcelExtractor, 'FAST_SCAN_MAX_BYTES', -1)
+    return request.param
+
+
+@pytest.fixture
+def hidden_merge_workbook(tmp_path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Report'
+    ws['A1'] = 'Title'
+    ws.merge_cells('A1:G1')
+    ws.append(['Ngày', 'Mã', 'CIF', 'Tên', 'Số tiền', 'Ghi chú', 'Loại'])
+    ws.append(['01/01', 'HN1', 'C1', 'A', 10, 'x', 'y'])
+    # Values left under the merge, as LibreOffice's "keep hidden contents" does
+    row1 = (b'<row r="1"><c r="A1" t="inlineStr"><is><t>Title</t></is></c>'
+            b'<c r="B1" t="inlineStr"><is><t>hidden1</t></is></c>'
+            b'<c r="C1" t="inlineStr"><is><t>hidden2</t></is></c>'
+            b'<c r="D1"><v>5</v></c></row>')
+    return _save_patched(wb, tmp_path / 'hidden.xlsx',
+                         {'xl/worksheets/sheet1.xml': (rb'<row r="1".*?</row>', row1)})
+
+
+def test_values_under_merge_read_as_blank(hidden_merge_workbook, fast_scan):
+    extractor = EnhancedExcelExtractor()
+    extracted = extractor.extract(hidden_merge_workbook)
+    sheet = extracted['sheets']['Report']
+
+    assert sheet['grid'][0] == ['Title', '', '', '', '', '', '']
+    assert sheet['nonempty_counts'][0] == 1
+    assert sheet['grid'][2][:2] == ['01/01', 'HN1']
+    assert [merged['value'] for merged in sheet['merged_cells']] == ['Title']
+    assert 'hidden' not in extractor.to_llm_optimized(extracted)
+
+
+def test_cell_without_style_uses_default_date_format(tmp_path, fast_scan):
+    wb = openpyxl.Workbook()
+    wb.active['A1'] = 45000
+    # Give cell style 0 a date format; the cell carries no s attribute
+    path = _save_patched(wb, tmp_path / 'default_date.xlsx',
+                         {'xl/styles.xml': (rb'(<cellXfs count="\d+"><xf numFmtId=")0"', rb'\g<1>14"')})
+
+    expected = str(openpyxl.load_workbook(path)['Sheet']['A1'].value)
+    sheet = EnhancedExcelExtractor().extract(path)['sheets']['Sheet']
+
+    assert expected == '2023-03-15 00:00:00'
+    assert sheet['grid'][0][0] == expected
+
+
+def test_calamine_reader_matches_xml_reader(tmp_path, monkeypatch):
+    pytest.importorskip('python_calamine')
+    from openpyxl.chart import BarChart, Reference
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Data'
+    ws['A1'] = 'Báo cáo'
+    ws.merge_cells('A1:F1')
+    ws.append(['Ngày', 'Mã', 'Số', 'Tỷ lệ', 'Đúng', 'Ghi chú'])
+    ws.append([datetime.datetime(2024, 1, 2), 'HN1', 10, 0.5, True, '  x  '])
+    ws.append([datetime.datetime(2024, 1, 3, 4, 5), 'HN2', 12345678901234, 1.5e-7, False, None])
+    ws['B5'] = 'merged'
+    ws.merge_cells('B5:C6')
+    chart = BarChart()
+    chart.add_data(Reference(ws, min_col=3, min_row=2, max_row=4))
+    wb.create_chartsheet('Chart').add_chart(chart)
+    wb.create_sheet('Empty')
+    path = str(tmp_path / 'calamine.xlsx')
+    wb.save(path)
+
+    expected = EnhancedExcelExtractor().extract(path)
+    # python-calamine reads .xlsx too, so the same file can go through both readers
+    monkeypatch.setattr(EnhancedExcelExtractor, 'CALAMINE_EXTENSIONS', ('.xls', '.xlsb', '.xlsx'))
+    actual = EnhancedExcelExtractor().extract(path)
+
+    assert list(actual['sheets']) == ['Data', 'Empty']
+    for name, sheet in expected['sheets'].items():
+        for key in ('grid', 'merged_cells', 'dimensions'):
+            assert actual['sheets'][name][key] == sheet[key], (name, key)
+
+
+def test_extract_result_is_json_serializable(hidden_merge_workbook):
+    extracted = EnhancedExcelExtractor().extract(hidden_merge_workbook)
+
+    assert set(extracted['sheets']['Report']) == {'grid', 'merged_cells', 'dimensions', 'nonempty_counts'}
+    json.dumps(extracted)
+
+
+def test_formatters_leave_extracted_data_unchanged(hidden_merge_workbook):
+    extractor = EnhancedExcelExtractor()
+    extracted = extractor.extract(hidden_merge_workbook)
+    before = copy.deepcopy(extracted)
+
+    first = extractor.to_hybrid_markdown(extracted)
+    extractor.to_llm_optimized(extracted)
+    extractor.to_plain_text(extracted)
+
+    assert extracted == before
+    assert extractor.to_hybrid_markdown(extracted) == first
+    # An edited grid is analysed again rather than served from the memo
+    extracted['sheets']['Report']['grid'][2][1] = 'HN9'
+    assert 'HN9' in extractor.to_hybrid_markdown(extracted)
+
+
+def test_collapse_repeated_rows_counts_runs_in_own_column(tmp_path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    headers = ['Ngày', 'Mã', 'CIF', 'Tên', 'Số tiền']
+    for row in (headers, ['01/01', 'HN1', 'C1', 'A', 10], ['01/01', 'HN1', 'C1', 'A', 10],
+                # Header printed again at a page break, inside a run of identical rows
+                headers, ['01/01', 'HN1', 'C1', 'A', 10],
+                ['01/02', 'HN2', 'C2', 'B', 20], ['01/03', 'HN3', 'C3', 'C', 30]):
+        ws.append(row)
+    path = str(tmp_path / 'repeated.xlsx')
+    wb.save(path)
+
+    extractor = EnhancedExcelExtractor(collapse_repeated_rows=True)
+    output = extractor.to_llm_optimized(extractor.extract(path))
+
+    assert output.splitlines() == [
+        '| Ngày | Mã | CIF | Tên | Số tiền | × |',
+        '| --- | --- | --- | --- | --- | --- |',
+        '| 01/01 | HN1 | C1 | A | 10 | ×3 |',
+        '| 01/02 | HN2 | C2 | B | 20 | - |',
+        '| 01/03 | HN3 | C3 | C | 30 | - |',
+    ]
+
+
+def test_collapse_without_repeats_keeps_table_shape(tmp_path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for row in (['Ngày', 'Mã', 'CIF', 'Tên', 'Số tiền'], ['01/01', 'HN1', 'C1', 'A', 10],
+                ['01/02', 'HN2', 'C2', 'B', 20]):
+        ws.append(row)
+    path = str(tmp_path / 'distinct.xlsx')
+    wb.save(path)
+
+    extracted = EnhancedExcelExtractor().extract(path)
+    assert (EnhancedExcelExtractor(collapse_repeated_rows=True).to_llm_optimized(extracted)
+            == EnhancedExcelExtractor().to_llm_optimized(extracted))
+
+
+def test_llm_optimized_file_matches_string(hidden_merge_workbook, tmp_path):
+    extractor = EnhancedExcelExtractor()
+    extracted = extractor.extract(hidden_merge_workbook)
+    path = tmp_path / 'out.md'
+    written = []
+
+    class Recorder:
+        def __init__(self, out):
+            self.out = out
+
+        def write(self, text):
+            written.append(text)
+            self.out.write(text)
+
+    out = extractor.to_llm_optimized_to_file(extracted, str(path), wrapper=Recorder)
+
+    assert isinstance(out, Recorder)
+    assert path.read_text(encoding='utf-8') == ''.join(written) == extractor.to_llm_optimized(extracted)